@@ -209,9 +209,8 @@ def perform_es_corr(
         )
 
     def e_per(encut):
-        eper = 0
-        for g2 in generate_reciprocal_vectors_squared(a1, a2, a3, encut):
-            eper += (q_model.rho_rec(g2) ** 2) / g2
+        g2 = generate_reciprocal_vectors_squared(a1, a2, a3, encut)
+        eper = np.sum(q_model.rho_rec(g2) ** 2 / g2)
         eper *= (q**2) * 2 * round(np.pi, 6) / vol
         eper += (q**2) * 4 * round(np.pi, 6) * q_model.rho_rec_limit0 / vol
         return eper
@@ -3,16 +3,17 @@ from __future__ import annotations
 
 import bisect
 import collections
+import itertools
 import logging
 import math
 import operator
-from copy import deepcopy
 from functools import cached_property
 from pathlib import Path
 from typing import Any, Callable, Generator
 
 import numpy as np
 from monty.json import MSONable
+from numba import njit, prange
 from numpy import typing as npt
 from numpy.linalg import norm
 from pymatgen.analysis.local_env import cn_opt_params
@@ -21,9 +22,16 @@ from pymatgen.core import Lattice, Structure
 from pymatgen.electronic_structure.core import Spin
 from pymatgen.io.vasp.outputs import BandStructure, Procar, VolumetricData
 from pymatgen.io.vasp.sets import get_valid_magmom_struct
-from scipy.cluster.hierarchy import fcluster, linkage
+from pymatgen.symmetry.analyzer import SpacegroupAnalyzer
+from scipy.cluster.hierarchy import fcluster
+from scipy.spatial import cKDTree
 from scipy.spatial.distance import squareform
 
+try:
+    from fastcluster import linkage
+except ImportError:
+    from scipy.cluster.hierarchy import linkage
+
 try:
     from skimage.feature import peak_local_max
 
@@ -50,7 +58,7 @@ motif_cn_op = {}
 for cn, di in cn_opt_params.items():
     for motif, li in di.items():
         motif_cn_op[motif] = {"cn": int(cn), "optype": li[0]}
-        motif_cn_op[motif]["params"] = deepcopy(li[1]) if len(li) > 1 else None
+        motif_cn_op[motif]["params"] = dict(li[1]) if len(li) > 1 else None
 
 
 class QModel(MSONable):
@@ -97,6 +105,11 @@ class QModel(MSONable):
         Returns:
             Charge density at the reciprocal vector magnitude
         """
+        if isinstance(g2, (int, float)):
+            # avoid the overhead of numpy for scalar calls e.g. from integrators
+            return self.expnorm / math.sqrt(1 + self.gamma2 * g2) + (
+                1 - self.expnorm
+            ) * math.exp(-0.25 * self.beta2 * g2)
         return self.expnorm / np.sqrt(1 + self.gamma2 * g2) + (
             1 - self.expnorm
         ) * np.exp(-0.25 * self.beta2 * g2)
@@ -123,7 +136,7 @@ def eV_to_k(energy):
     return math.sqrt(energy / invang_to_ev) * ang_to_bohr
 
 
-def genrecip(a1, a2, a3, encut) -> Generator[npt.ArrayLike, None, None]:
+def genrecip(a1, a2, a3, encut) -> tuple[npt.NDArray, npt.NDArray]:
     """Generate reciprocal lattice vectors within the energy cutoff.
 
     Args:
@@ -133,19 +146,19 @@ def genrecip(a1, a2, a3, encut) -> Generator[npt.ArrayLike, None, None]:
         encut: energy cut off in eV
 
     Returns:
-        reciprocal lattice vectors with energy less than encut
+        tuple[npt.NDArray, npt.NDArray]: The (N, 3) array of reciprocal lattice
+        vectors with energy less than encut and the (N,) array of their squared
+        magnitudes.
     """
-    vol = np.dot(a1, np.cross(a2, a3))  # 1/bohr^3
-    b1 = (2 * np.pi / vol) * np.cross(a2, a3)  # units 1/bohr
-    b2 = (2 * np.pi / vol) * np.cross(a3, a1)
-    b3 = (2 * np.pi / vol) * np.cross(a1, a2)
+    a23 = np.cross(a2, a3)
+    vol = np.dot(a1, a23)  # 1/bohr^3
+    # rows are the reciprocal lattice vectors b1, b2, b3 in units of 1/bohr
+    recip = (2 * np.pi / vol) * np.array([a23, np.cross(a3, a1), np.cross(a1, a2)])
 
     # create list of recip space vectors that satisfy |i*b1+j*b2+k*b3|<=encut
     G_cut = eV_to_k(encut)
     # Figure out max in all recipricol lattice directions
-    i_max = int(math.ceil(G_cut / norm(b1)))
-    j_max = int(math.ceil(G_cut / norm(b2)))
-    k_max = int(math.ceil(G_cut / norm(b3)))
+    i_max, j_max, k_max = np.ceil(G_cut / norm(recip, axis=1)).astype(int)
 
     # Build index list
     i = np.arange(-i_max, i_max)
@@ -155,17 +168,16 @@ def genrecip(a1, a2, a3, encut) -> Generator[npt.ArrayLike, None, None]:
     # Convert index to vectors using meshgrid
     indices = np.array(np.meshgrid(i, j, k)).T.reshape(-1, 3)
     # Multiply integer vectors to get recipricol space vectors
-    vecs = np.dot(indices, [b1, b2, b3])
-    # Calculate radii of all vectors
-    radii = np.sqrt(np.einsum("ij,ij->i", vecs, vecs))
+    vecs = np.dot(indices, recip)
+    # Calculate the squared magnitudes of all vectors, no need for the sqrt
+    g2 = np.einsum("ij,ij->i", vecs, vecs)
 
-    # Yield based on radii
-    for vec, r in zip(vecs, radii):
-        if r < G_cut and r != 0:
-            yield vec
+    # Filter based on magnitudes
+    mask = (g2 > 0) & (g2 < G_cut * G_cut)
+    return vecs[mask], g2[mask]
 
 
-def generate_reciprocal_vectors_squared(a1, a2, a3, encut):
+def generate_reciprocal_vectors_squared(a1, a2, a3, encut) -> npt.NDArray:
     """Generate Reciprocal vectors squared.
 
     Generate reciprocal vector magnitudes within the cutoff along the specified
@@ -178,22 +190,47 @@ def generate_reciprocal_vectors_squared(a1, a2, a3, encut):
         encut: Reciprocal vector energy cutoff
 
     Returns:
-        [[g1^2], [g2^2], ...] Square of reciprocal vectors (1/Bohr)^2
+        npt.NDArray: [g1^2, g2^2, ...] Square of reciprocal vectors (1/Bohr)^2
         determined by a1, a2, a3 and whose magntidue is less than gcut^2.
     """
-    for vec in genrecip(a1, a2, a3, encut):
-        yield np.dot(vec, vec)
+    _, g2 = genrecip(a1, a2, a3, encut)
+    return g2
+
 
+def converge(f, step, tol, max_h, accelerate=False):
+    """Simple newton iteration based convergence function.
 
-def converge(f, step, tol, max_h):
-    """Simple newton iteration based convergence function."""
+    Args:
+        f: The function to converge, evaluated at ``0, step, 2*step, ...``.
+        step: The step size.
+        tol: The convergence tolerance.
+        max_h: The maximum value of the argument before giving up.
+        accelerate: Use Aitken's delta-squared extrapolation of the last three
+            values to estimate the limit, convergence is reached when two successive
+            estimates agree within ``tol``. For smoothly converging functions this
+            requires far fewer evaluations of ``f``.
+
+    Returns:
+        The converged value of ``f``.
+    """
     g = f(0)
+    g_prev = g_aitken = None
     dx = 10000
     h = step
     while dx > tol:
         g2 = f(h)
         dx = abs(g - g2)
-        g = g2
+        if accelerate and g_prev is not None:
+            denom = g2 - 2 * g + g_prev
+            g_aitken_prev = g_aitken
+            g_aitken = g2 - (g2 - g) ** 2 / denom if denom != 0 else None
+            if (
+                g_aitken is not None
+                and g_aitken_prev is not None
+                and abs(g_aitken - g_aitken_prev) < tol
+            ):
+                return g_aitken
+        g_prev, g = g, g2
         h += step
 
         if h > max_h:
@@ -215,12 +252,9 @@ def get_zfile(
         Path | None: A path to the matched file. If ``allow_missing=True``
         and the file cannot be found, then ``None`` will be returned.
     """
-    for file in directory.glob(f"{base_name}*"):
-        if base_name == file.name:
-            return file
-        elif base_name + ".gz" == file.name:
-            return file
-        elif base_name + ".GZ" == file.name:
+    for suffix in ("", ".gz", ".GZ"):
+        file = directory / f"{base_name}{suffix}"
+        if file.exists():
             return file
 
     if allow_missing:
@@ -232,6 +266,9 @@ def get_zfile(
 def generic_groupby(list_in, comp=operator.eq):
     """Group a list of unsortable objects.
 
+    The groups are tracked with a union-find structure so ``comp`` is only called
+    for pairs that are not already known to belong to the same group.
+
     Args:
         list_in: A list of generic objects
         comp: (Default value = operator.eq) The comparator
@@ -240,21 +277,53 @@ def generic_groupby(list_in, comp=operator.eq):
         list[int]: list of labels for the input list
 
     """
-    list_out = [None] * len(list_in)
-    label_num = 0
-    for i1, ls1 in enumerate(list_out):
-        if ls1 is not None:
-            continue
-        list_out[i1] = label_num
-        for i2, ls2 in list(enumerate(list_out))[(i1 + 1) :]:
-            if comp(list_in[i1], list_in[i2]):
-                if ls2 is None:
-                    list_out[i2] = list_out[i1]
-                else:
-                    list_out[i1] = ls2
-                    label_num -= 1
-        label_num += 1
-    return list_out
+    parent = list(range(len(list_in)))
+
+    def _find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i1 in range(len(list_in)):
+        for i2 in range(i1 + 1, len(list_in)):
+            r1, r2 = _find(i1), _find(i2)
+            if r1 != r2 and comp(list_in[i1], list_in[i2]):
+                parent[max(r1, r2)] = min(r1, r2)
+
+    # relabel the roots with consecutive integers in order of first appearance
+    root_labels: dict[int, int] = {}
+    return [
+        root_labels.setdefault(_find(i), len(root_labels)) for i in range(len(list_in))
+    ]
+
+
+def get_symmetry_labels(
+    fcoords: npt.ArrayLike, structure: Structure, tol: float = 0.5
+) -> list[int]:
+    """Group points that are equivalent under the symmetry of a structure.
+
+    Args:
+        fcoords: fractional coordinates of the points to group.
+        structure: The structure whose symmetry operations are used.
+        tol: Distance tolerance in Å for two points to be considered the same.
+            PBC is taken into account.
+
+    Returns:
+        list[int]: list of labels for the input points
+    """
+    fcoords = np.asarray(fcoords)
+    if len(fcoords) == 0:
+        return []
+    lattice = structure.lattice
+    equivalent = np.zeros((len(fcoords), len(fcoords)), dtype=bool)
+    for op in SpacegroupAnalyzer(structure).get_symmetry_operations():
+        equivalent |= (
+            lattice.get_all_distances(op.operate_multi(fcoords), fcoords) < tol
+        )
+    return generic_groupby(
+        list(range(len(fcoords))), comp=lambda i, j: equivalent[i, j]
+    )
 
 
 def get_local_extrema(chgcar: VolumetricData, find_min: bool = True) -> npt.NDArray:
@@ -276,20 +345,20 @@ def get_local_extrema(chgcar: VolumetricData, find_min: bool = True) -> npt.NDAr
     else:
         sign = 1
 
-    # Make 3x3x3 supercell
+    # Pad the grid periodically by the size of the peak search neighborhood.
     # This is a trick to resolve the periodical boundary issue.
     # TODO: Add code to pyrho for max and min filtering.
+    min_distance = 1
     total_chg = sign * chgcar.data["total"]
-    total_chg = np.tile(total_chg, reps=(3, 3, 3))
-    coordinates = peak_local_max(total_chg, min_distance=1)
+    padded_chg = np.pad(total_chg, min_distance, mode="wrap")
+    coordinates = peak_local_max(padded_chg, min_distance=min_distance)
 
-    # Remove duplicated sites introduced by supercell.
-    f_coords = [coord / total_chg.shape * 3 for coord in coordinates]
-    f_coords = [
-        f - 1 for f in f_coords if all(np.array(f) < 2) and all(np.array(f) >= 1)
-    ]
+    # Only keep the peaks inside the original unit cell.
+    coordinates = coordinates - min_distance
+    in_cell = np.all((coordinates >= 0) & (coordinates < total_chg.shape), axis=1)
+    f_coords = coordinates[in_cell] / total_chg.shape
 
-    return np.array(f_coords)
+    return f_coords
 
 
 def remove_collisions(
@@ -305,13 +374,30 @@ def remove_collisions(
     Returns:
         fcoord (numpy.ndarray): The filtered coordinates.
     """
+    fcoords = np.asarray(fcoords, dtype=float).reshape(-1, 3)
     s_fcoord = structure.frac_coords
     _logger.info(s_fcoord)
-    dist_matrix = structure.lattice.get_all_distances(fcoords, s_fcoord)
-    all_dist = np.min(dist_matrix, axis=1)
-    return np.array(
-        [fcoords[i] for i in range(len(fcoords)) if all_dist[i] >= min_dist]
+    # Index the host atoms and their periodic images in the neighboring cells,
+    # everything is wrapped into the unit cell so that these images are enough
+    # to find the nearest atom within ``min_dist``.
+    images = np.array(list(itertools.product((-1, 0, 1), repeat=3)))
+    s_fcoord = s_fcoord - np.floor(s_fcoord)
+    image_fcoords = (s_fcoord[None, :, :] + images[:, None, :]).reshape(-1, 3)
+    # Images outside of the unit cell padded by ``min_dist`` can never collide.
+    frac_pad = min_dist * np.array(
+        structure.lattice.reciprocal_lattice_crystallographic.abc
+    )
+    in_box = np.all(
+        (image_fcoords > -frac_pad) & (image_fcoords < 1 + frac_pad), axis=1
+    )
+    tree = cKDTree(structure.lattice.get_cartesian_coords(image_fcoords[in_box]))
+    # Stop searching beyond ``min_dist``, points without a neighbor get ``inf``.
+    all_dist, _ = tree.query(
+        structure.lattice.get_cartesian_coords(fcoords - np.floor(fcoords)),
+        k=1,
+        distance_upper_bound=min_dist,
     )
+    return fcoords[all_dist >= min_dist]
 
 
 def cluster_nodes(
@@ -334,27 +420,80 @@ def cluster_nodes(
     condensed_m = squareform(dist_matrix)
     z = linkage(condensed_m)
     cn = fcluster(z, tol, criterion="distance")
+    fcoords = np.asarray(fcoords)
     merged_fcoords = []
 
     for n in set(cn):
-        frac_coords = []
-        for i, j in enumerate(np.where(cn == n)[0]):
-            if i == 0:
-                frac_coords.append(fcoords[j])
-            else:
-                fcoord = fcoords[j]
-                # We need the image to combine the frac_coords properly.
-                d, image = lattice.get_distance_and_image(frac_coords[0], fcoord)
-                frac_coords.append(fcoord + image)
-        merged_fcoords.append(np.average(frac_coords, axis=0))
-
-    merged_fcoords = [f - np.floor(f) for f in merged_fcoords]
-    merged_fcoords = [f * (np.abs(f - 1) > 1e-15) for f in merged_fcoords]
+        members = np.where(cn == n)[0]
+        # Shift every member to the periodic image closest to the first member
+        # so that the cluster can be averaged properly.
+        deltas = fcoords[members] - fcoords[members[0]]
+        deltas -= np.round(deltas)
+        merged_fcoords.append(fcoords[members[0]] + deltas.mean(axis=0))
+
+    merged_fcoords = np.array(merged_fcoords)
+    merged_fcoords -= np.floor(merged_fcoords)
+    merged_fcoords[np.abs(merged_fcoords - 1) <= 1e-15] = 0.0
     # the second line for fringe cases like
     # np.array([ 5.0000000e-01 -4.4408921e-17  5.0000000e-01])
     # where the shift to [0,1) does not work due to float precision
 
-    return np.array(merged_fcoords)
+    return merged_fcoords
+
+
+@njit(cache=True, parallel=True, fastmath=True)
+def _avg_chg_kernel(
+    chg: npt.NDArray,
+    metric: npt.NDArray,
+    fcoord: npt.NDArray,
+    frac_bounds: npt.NDArray,
+    r2: float,
+) -> tuple[float, int]:  # pragma: no cover
+    """Sum the charge on the grid points inside a sphere.
+
+    The minimum image is obtained by rounding the fractional offsets which is exact
+    as long as the radius is smaller than half of the smallest interplanar spacing.
+
+    Args:
+        chg: The charge density on the grid.
+        metric: The metric tensor of the lattice.
+        fcoord: The fractional coordinates of the center of the sphere.
+        frac_bounds: The fractional extent of the sphere along each axis.
+        r2: The square of the radius of the sphere.
+
+    Returns:
+        The sum of the charge and the number of grid points inside the sphere.
+    """
+    na, nb, nc = chg.shape
+    sum_chg = 0.0
+    n_pts = 0
+    for ia in prange(na):
+        da = ia / na - fcoord[0]
+        da -= np.floor(da + 0.5)
+        if abs(da) > frac_bounds[0]:
+            continue
+        for ib in range(nb):
+            db = ib / nb - fcoord[1]
+            db -= np.floor(db + 0.5)
+            if abs(db) > frac_bounds[1]:
+                continue
+            for ic in range(nc):
+                dc = ic / nc - fcoord[2]
+                dc -= np.floor(dc + 0.5)
+                if abs(dc) > frac_bounds[2]:
+                    continue
+                d2 = (
+                    metric[0, 0] * da * da
+                    + metric[1, 1] * db * db
+                    + metric[2, 2] * dc * dc
+                    + 2 * metric[0, 1] * da * db
+                    + 2 * metric[0, 2] * da * dc
+                    + 2 * metric[1, 2] * db * dc
+                )
+                if d2 < r2:
+                    sum_chg += chg[ia, ib, ic]
+                    n_pts += 1
+    return sum_chg, n_pts
 
 
 def get_avg_chg(
@@ -366,32 +505,52 @@ def get_avg_chg(
         chgcar: The charge density.
         fcoord: The fractional coordinates of the center of the sphere.
         radius: The radius of the sphere in Angstroms.
+            The nearest periodic image of each grid point is found by rounding
+            the fractional offsets, which is exact when ``2 * radius`` is smaller
+            than the smallest interplanar spacing of the lattice. Larger spheres
+            fall back to the slower ``Lattice.get_all_distances``.
 
     Returns:
         The average charge in the sphere.
 
-
+    Raises:
+        ValueError: If no grid point lies inside the sphere.
     """
     # makesure fcoord is an array
     fcoord = np.array(fcoord)
-
-    def _dist_mat(pos_frac):
-        # return a matrix that contains the distances
-        aa = np.linspace(0, 1, len(chgcar.get_axis_grid(0)), endpoint=False)
-        bb = np.linspace(0, 1, len(chgcar.get_axis_grid(1)), endpoint=False)
-        cc = np.linspace(0, 1, len(chgcar.get_axis_grid(2)), endpoint=False)
-        AA, BB, CC = np.meshgrid(aa, bb, cc, indexing="ij")
-        dist_from_pos = chgcar.structure.lattice.get_all_distances(
-            fcoords1=np.vstack([AA.flatten(), BB.flatten(), CC.flatten()]).T,
-            fcoords2=pos_frac,
-        )
-        return dist_from_pos.reshape(AA.shape)
-
     if np.any(fcoord < 0) or np.any(fcoord > 1):
         raise ValueError("f_coords must be in [0,1)")
-    mask = _dist_mat(fcoord) < radius
-    vol_sphere = chgcar.structure.volume * (mask.sum() / chgcar.ngridpts)
-    avg_chg = np.sum(chgcar.data["total"] * mask) / mask.size / vol_sphere
+
+    lattice = chgcar.structure.lattice
+    total_chg = chgcar.data["total"]
+    inv_spacings = np.array(lattice.reciprocal_lattice_crystallographic.abc)
+    if 2 * radius * inv_spacings.max() >= 1:
+        # rounding can pick the wrong periodic image, check all of them instead
+        grid_fcoords = np.meshgrid(
+            *(np.arange(n) / n for n in total_chg.shape), indexing="ij"
+        )
+        dist_from_pos = lattice.get_all_distances(
+            np.stack(grid_fcoords, axis=-1).reshape(-1, 3), fcoord
+        )
+        mask = dist_from_pos.reshape(total_chg.shape) < radius
+        sum_chg, n_pts = total_chg[mask].sum(), mask.sum()
+    else:
+        # radius * inv_spacings is the fractional extent of the sphere along each
+        # axis, used by the kernel to skip whole planes
+        sum_chg, n_pts = _avg_chg_kernel(
+            np.ascontiguousarray(total_chg, dtype=np.float64),
+            lattice.metric_tensor,
+            fcoord.astype(np.float64),
+            radius * inv_spacings,
+            radius * radius,
+        )
+    if n_pts == 0:
+        raise ValueError(
+            f"No grid points within {radius} Å of {fcoord.tolist()}, "
+            "use a larger radius."
+        )
+    vol_sphere = chgcar.structure.volume * (n_pts / chgcar.ngridpts)
+    avg_chg = sum_chg / chgcar.ngridpts / vol_sphere
     return avg_chg
 
 
@@ -466,8 +625,16 @@ class ChargeInsertionAnalyzer(MSONable):
         )
 
         # Group the candidate sites by symmetry
+        sym_labels = get_symmetry_labels(
+            local_minima, structure=self.chgcar.structure, tol=self.clustering_tol
+        )
+        # the first member of each symmetry group is used as its representative
+        representatives = [
+            sym_labels.index(lab) for lab in range(max(sym_labels, default=-1) + 1)
+        ]
+
         inserted_structs = []
-        for fpos in local_minima:
+        for fpos in local_minima[representatives]:
             tmp_struct = self.chgcar.structure.copy()
             get_valid_magmom_struct(tmp_struct, inplace=True, spin_mode="none")
             tmp_struct.insert(
@@ -479,7 +646,8 @@ class ChargeInsertionAnalyzer(MSONable):
             inserted_structs.append(tmp_struct)
 
         # Label the groups by structure matching
-        site_labels = generic_groupby(inserted_structs, comp=self.sm.fit)
+        group_labels = generic_groupby(inserted_structs, comp=self.sm.fit)
+        site_labels = [group_labels[lab] for lab in sym_labels]
         return [*zip(local_minima.tolist(), site_labels)]
 
     @cached_property
@@ -520,10 +688,10 @@ class ChargeInsertionAnalyzer(MSONable):
         return res
 
 
-def _get_ipr(spin, k_index, procar):
-    states = procar.data[spin][k_index, ...]
-    flat_states = states.reshape(states.shape[0], -1)
-    return 1 / np.sum(flat_states**2, axis=1)
+def _get_ipr(spin, procar):
+    states = procar.data[spin]
+    flat_states = states.reshape(states.shape[0], states.shape[1], -1)
+    return 1 / np.sum(flat_states**2, axis=-1)
 
 
 def get_ipr_in_window(
@@ -554,10 +722,11 @@ def get_ipr_in_window(
         )
         lbound = max(last_occ_idx - band_window, 0)
         ubound = min(last_occ_idx + band_window, bandstructure.nb_bands)
+        ipr = _get_ipr(spin, procar)
+        band_indices = np.arange(lbound, ubound)
         for k_idx, _ in enumerate(bandstructure.kpoints):
-            ipr = _get_ipr(spin, k_idx, procar)
             res[(k_idx, s_index)] = np.stack(
-                (np.arange(lbound, ubound), ipr[lbound:ubound])
+                (band_indices, ipr[k_idx, lbound:ubound])
             ).T
     return res
 
@@ -590,7 +759,11 @@ def get_localized_states(
 
 
 def sort_positive_definite(
-    list_in: list, ref1: Any, ref2: Any, dist: Callable
+    list_in: list,
+    ref1: Any,
+    ref2: Any,
+    dist: Callable,
+    batch_dist: Callable | None = None,
 ) -> tuple[list, list[float]]:
     """Sort a list where we can only compute a positive-definite distance.
 
@@ -605,21 +778,22 @@ def sort_positive_definite(
         ref1: The first reference point, this will be the `zero` point.
         ref2: The second reference point, this will determine the direction.
         dist: Some positive definite distance function.
+        batch_dist: Optional vectorized version of ``dist`` that takes the whole list
+            and a reference point and returns an array of distances.
 
     Returns:
         - the sorted list of objects.
         - the signed distance in the chosen direction.
     """
-    d1 = [dist(el, ref1) for el in list_in]
-    d2 = [dist(el, ref2) for el in list_in]
+    if batch_dist is None:
+
+        def batch_dist(els, ref):
+            return np.fromiter((dist(el, ref) for el in els), dtype=float)
+
+    d1 = np.asarray(batch_dist(list_in, ref1), dtype=float)
+    d2 = np.asarray(batch_dist(list_in, ref2), dtype=float)
     D0 = dist(ref1, ref2)
 
-    d_vs_s = []
-    for q1, q2, el in zip(d1, d2, list_in):
-        sign = +1
-        if q1 < q2 and q2 > D0:
-            sign = -1
-        d_vs_s.append((sign * q1, el))
-    d_vs_s.sort()
-    distances, sorted_list = list(zip(*d_vs_s))
-    return sorted_list, distances
+    signed_d1 = np.where((d1 < d2) & (d2 > D0), -1.0, 1.0) * d1
+    order = np.argsort(signed_d1, kind="stable")
+    return [list_in[i] for i in order], signed_d1[order].tolist()
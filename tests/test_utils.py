@@ -1,16 +1,78 @@
 import numpy as np
 import pytest
+from pymatgen.core import Structure
 from pymatgen.io.vasp.outputs import Chgcar
 
+from pymatgen.analysis.defects import utils
 from pymatgen.analysis.defects.utils import (
     ChargeInsertionAnalyzer,
+    QModel,
     cluster_nodes,
+    converge,
+    eV_to_k,
+    generic_groupby,
+    genrecip,
     get_avg_chg,
     get_local_extrema,
     get_localized_states,
+    get_symmetry_labels,
+    remove_collisions,
+    sort_positive_definite,
 )
 
 
+def test_qmodel():
+    qmodel = QModel(beta=2.0, expnorm=0.5, gamma=1.5)
+    g2 = np.linspace(0, 10, 11)
+    rho = qmodel.rho_rec(g2)
+    assert rho[0] == pytest.approx(1.0)
+    assert [qmodel.rho_rec(float(x)) for x in g2] == pytest.approx(rho)
+    assert qmodel.rho_rec(2) == pytest.approx(rho[2])
+
+
+def test_converge():
+    n_calls = 0
+
+    def f(h):
+        nonlocal n_calls
+        n_calls += 1
+        return 1 - 0.5**h
+
+    assert converge(f, 1, 1e-6, 100) == pytest.approx(1, abs=1e-6)
+    n_plain, n_calls = n_calls, 0
+    # the geometric series is extrapolated exactly by Aitken's method
+    assert converge(f, 1, 1e-6, 100, accelerate=True) == pytest.approx(1)
+    assert n_calls < n_plain
+
+    with pytest.raises(Exception, match="Did not converge"):
+        converge(f, 1, 1e-6, 5)
+
+
+def test_genrecip():
+    a1, a2, a3 = np.eye(3) * 10
+    vecs, g2 = genrecip(a1, a2, a3, encut=50)
+    assert vecs.shape == (len(g2), 3)
+    assert np.allclose(np.sum(vecs**2, axis=1), g2)
+    assert np.all(g2 > 0)
+    assert np.all(np.sqrt(g2) < eV_to_k(50))
+
+
+def test_generic_groupby():
+    assert generic_groupby([1, 2, 1, 3, 2, 3]) == [0, 1, 0, 2, 1, 2]
+
+    n_calls = 0
+
+    def _same_parity(a, b):
+        nonlocal n_calls
+        n_calls += 1
+        return a % 2 == b % 2
+
+    labels = generic_groupby([0, 1, 2, 3, 4, 5], comp=_same_parity)
+    assert labels == [0, 1, 0, 1, 0, 1]
+    # pairs that are already grouped together are not compared again
+    assert n_calls < 15
+
+
 def test_get_local_extrema(gan_struct):
     data = np.ones((48, 48, 48))
     chgcar = Chgcar(poscar=gan_struct, data={"total": data})
@@ -23,6 +85,24 @@ def test_get_local_extrema(gan_struct):
         assert np.allclose(a, b)
 
 
+def test_remove_collisions(gan_struct):
+    atom_fcoords = gan_struct.frac_coords
+    fcoords = np.vstack(
+        [atom_fcoords + 0.001, atom_fcoords - 1.001, [[0.1, 0.2, 0.3], [0.6, 0.5, 0.1]]]
+    )
+    dists = np.min(gan_struct.lattice.get_all_distances(fcoords, atom_fcoords), axis=1)
+    res = remove_collisions(fcoords, gan_struct, min_dist=0.9)
+    assert np.allclose(res, fcoords[dists >= 0.9])
+
+
+def test_get_symmetry_labels(gan_struct):
+    # the inversion center lies between these two points
+    fcoords = [[0.1, 0.2, 0.3], [0.9, 0.8, 0.7], [0.0, 0.0, 0.25]]
+    struct = Structure(gan_struct.lattice, ["Si"], [[0, 0, 0]])
+    assert get_symmetry_labels(fcoords, struct, tol=0.1) == [0, 0, 1]
+    assert get_symmetry_labels([], struct) == []
+
+
 def test_cluster_nodes(gan_struct):
     frac_pos = [
         [0, 0, 0],
@@ -41,6 +121,13 @@ def test_cluster_nodes(gan_struct):
     for a, b in zip(sorted(clusters.tolist()), sorted(frac_pos)):
         assert np.allclose(a, b, atol=0.001)
 
+    # clusters that straddle the periodic boundary
+    clusters = cluster_nodes(
+        [[0.9999, 0.5, 0.5], [0.0001, 0.5, 0.5], [0.0003, 0.5, 0.5]], gan_struct.lattice
+    )
+    assert len(clusters) == 1
+    assert np.allclose(clusters[0], [0.0001, 0.5, 0.5])
+
 
 def test_get_avg_chg(gan_struct):
     data = np.ones((48, 48, 48))
@@ -48,7 +135,56 @@ def test_get_avg_chg(gan_struct):
     fpos = [0.1, 0.1, 0.1]
     avg_chg_sphere = get_avg_chg(chgcar, fpos)
     avg_chg = np.sum(chgcar.data["total"]) / chgcar.ngridpts / chgcar.structure.volume
-    pytest.approx(avg_chg_sphere, avg_chg)
+    assert avg_chg_sphere == pytest.approx(avg_chg)
+
+    # non-uniform data on a hexagonal cell compared against a brute-force mask
+    shape = (24, 24, 40)
+    data = np.random.default_rng(42).random(shape)
+    chgcar = Chgcar(poscar=gan_struct, data={"total": data})
+    grid_fcoords = np.stack(
+        np.meshgrid(*(np.arange(n) / n for n in shape), indexing="ij"), axis=-1
+    ).reshape(-1, 3)
+    # the smallest interplanar spacing of GaN is ~2.79 Å so the larger radii
+    # can no longer use the rounded minimum image
+    for fpos in [[0.1, 0.1, 0.1], [0.95, 0.02, 0.51]]:
+        for radius in [0.77, 1.31, 1.53, 2.1]:
+            dists = gan_struct.lattice.get_all_distances(grid_fcoords, fpos)
+            mask = dists.reshape(shape) < radius
+            ref = data[mask].sum() / gan_struct.volume / mask.sum()
+            assert get_avg_chg(chgcar, fpos, radius) == pytest.approx(ref)
+
+
+def test_get_avg_chg_empty_sphere(gan_struct):
+    data = np.random.default_rng(0).random((24, 24, 40))
+    chgcar = Chgcar(poscar=gan_struct, data={"total": data})
+    d_min = 1 / max(gan_struct.lattice.reciprocal_lattice_crystallographic.abc)
+    # both the kernel and the fallback path report an empty sphere the same way
+    with pytest.raises(ValueError, match="No grid points"):
+        get_avg_chg(chgcar, [0.51, 0.51, 0.51], radius=0.01)
+    chgcar = Chgcar(poscar=gan_struct, data={"total": np.ones((2, 2, 2))})
+    with pytest.raises(ValueError, match="No grid points"):
+        get_avg_chg(chgcar, [0.25, 0.25, 0.25], radius=0.5 * d_min)
+
+
+def test_get_avg_chg_radius_guard(gan_struct, monkeypatch):
+    data = np.random.default_rng(0).random((24, 24, 40))
+    chgcar = Chgcar(poscar=gan_struct, data={"total": data})
+    d_min = 1 / max(gan_struct.lattice.reciprocal_lattice_crystallographic.abc)
+
+    kernel = utils._avg_chg_kernel
+    kernel_calls = []
+
+    def _spy(*args):
+        kernel_calls.append(args)
+        return kernel(*args)
+
+    monkeypatch.setattr(utils, "_avg_chg_kernel", _spy)
+    # the rounded minimum image is only used below half the interplanar spacing
+    get_avg_chg(chgcar, [0.1, 0.1, 0.1], radius=0.49 * d_min)
+    assert len(kernel_calls) == 1
+    get_avg_chg(chgcar, [0.1, 0.1, 0.1], radius=0.5 * d_min)
+    get_avg_chg(chgcar, [0.1, 0.1, 0.1], radius=2 * d_min)
+    assert len(kernel_calls) == 1
 
 
 def test_chgcar_insertion(chgcar_fe3o4):
@@ -67,7 +203,7 @@ def test_chgcar_insertion(chgcar_fe3o4):
     insert_groups = cia.filter_and_group(max_avg_charge=0.5)
     for (avg_chg, group), (ref_chg, ref_fpos) in zip(insert_groups, insert_ref):
         fpos = sorted(group)
-        pytest.approx(avg_chg, ref_chg)
+        assert avg_chg == pytest.approx(ref_chg)
         assert np.allclose(fpos, ref_fpos)
 
 
@@ -95,3 +231,20 @@ def test_get_localized_states(v_ga):
     ):
         loc_bands.add(iband)
     assert loc_bands == {75, 77}  # 75 and 77 are more localized core states
+
+
+def test_sort_positive_definite():
+    points = [np.array([x, 0.0]) for x in [0.5, -1.0, 2.0, 0.0, 1.0]]
+
+    def dist(a, b):
+        return np.linalg.norm(a - b)
+
+    def batch_dist(els, ref):
+        return np.linalg.norm(np.array(els) - ref, axis=1)
+
+    for kwargs in [{}, {"batch_dist": batch_dist}]:
+        sorted_list, distances = sort_positive_definite(
+            points, points[3], points[4], dist, **kwargs
+        )
+        assert [p[0] for p in sorted_list] == [-1.0, 0.0, 0.5, 1.0, 2.0]
+        assert np.allclose(distances, [-1.0, 0.0, 0.5, 1.0, 2.0])